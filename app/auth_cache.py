@@ -0,0 +1,72 @@
+"""
+Short-lived in-process caches for authentication lookups.
+
+Repeated requests with the same JWT or API key skip the signature check and
+the database round-trips for a few seconds. TTLs are kept short so that
+revocations and profile changes propagate quickly.
+
+All access happens on the event loop thread and no entry is awaited between
+lookup and use, so the caches need no additional locking.
+"""
+import hashlib
+import time
+from typing import Optional
+
+from cachetools import TTLCache
+
+from app.models import User, APIKey
+
+CACHE_MAX_SIZE = 10_000
+TOKEN_CACHE_TTL_SECONDS = 5
+API_KEY_CACHE_TTL_SECONDS = 10
+
+# sha256(token) -> (user_id, exp)
+_token_cache: TTLCache = TTLCache(maxsize=CACHE_MAX_SIZE, ttl=TOKEN_CACHE_TTL_SECONDS)
+# user_id -> detached User
+_user_cache: TTLCache = TTLCache(maxsize=CACHE_MAX_SIZE, ttl=TOKEN_CACHE_TTL_SECONDS)
+# key_hash -> (detached User, detached APIKey)
+_api_key_cache: TTLCache = TTLCache(maxsize=CACHE_MAX_SIZE, ttl=API_KEY_CACHE_TTL_SECONDS)
+
+
+def _token_key(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+
+def get_token_subject(token: str) -> Optional[str]:
+    """Return the cached user id for an already verified, unexpired token"""
+    entry = _token_cache.get(_token_key(token))
+    if entry is None:
+        return None
+
+    user_id, exp = entry
+    if exp is not None and exp <= time.time():
+        return None
+    return user_id
+
+
+def cache_token_subject(token: str, user_id: str, exp: Optional[int]) -> None:
+    """Remember the subject of a token whose signature has been verified"""
+    _token_cache[_token_key(token)] = (user_id, exp)
+
+
+def get_user(user_id: str) -> Optional[User]:
+    return _user_cache.get(user_id)
+
+
+def cache_user(user: User) -> None:
+    """Cache a user row. The instance must already be detached from its session."""
+    _user_cache[user.id] = user
+
+
+def get_api_key(key_hash: str) -> Optional[tuple[User, APIKey]]:
+    return _api_key_cache.get(key_hash)
+
+
+def cache_api_key(key_hash: str, user: User, api_key: APIKey) -> None:
+    """Cache an API key with its owner. Both instances must already be detached."""
+    _api_key_cache[key_hash] = (user, api_key)
+
+
+def invalidate_api_key(key_hash: str) -> None:
+    """Drop a cached API key, e.g. after it has been rolled over or revoked"""
+    _api_key_cache.pop(key_hash, None)
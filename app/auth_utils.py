@@ -2,14 +2,18 @@
 Authentication utilities for JWT token creation and verification
 """
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from typing import Optional, Union
-from jose import JWTError, jwt
-from fastapi import Depends, HTTPException, status, Header
+import jwt
+from fastapi import Depends, HTTPException, status, Header, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, func
 import hashlib
+import logging
+import ssl
 
+from app import auth_cache
 from app.config import settings
 from app.database import get_db
 from app.models import User, APIKey
@@ -20,21 +24,94 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 # Security scheme
 security = HTTPBearer()
+BEARER_PREFIX = "Bearer "
+
+logger = logging.getLogger(__name__)
+
+# Bound once so the per-request hash skips the module attribute lookup
+_sha256 = hashlib.sha256
+
+
+def hash_api_key(api_key: str) -> str:
+    """Hash an API key for storage and lookup (hex-encoded SHA-256)"""
+    return _sha256(api_key.encode()).hexdigest()
+
+
+def check_hash_acceleration() -> None:
+    """
+    Log the OpenSSL build backing hashlib and warn if the CPU does not
+    advertise SHA extensions, in which case API key hashing falls back to
+    the slower portable implementation.
+    """
+    logger.info("hashlib backed by %s", ssl.OPENSSL_VERSION)
+    
+    try:
+        with open("/proc/cpuinfo") as cpuinfo:
+            flags = cpuinfo.read()
+    except OSError:
+        return
+    
+    if "sha_ni" not in flags and "sha2" not in flags:
+        logger.warning("CPU does not report SHA extensions; SHA-256 will use the portable path")
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token"""
     to_encode = data.copy()
+    now = datetime.now(timezone.utc)
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = now + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        expire = now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, settings.app_secret_key, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def extract_bearer_token(authorization: Optional[str]) -> Optional[str]:
+    """Return the token from an "Authorization: Bearer <token>" header, if any"""
+    if authorization and authorization.startswith(BEARER_PREFIX):
+        return authorization[len(BEARER_PREFIX):]
+    return None
+
+
+async def get_user_from_token(token: str, db: AsyncSession) -> Optional[User]:
+    """
+    Resolve the user for a JWT access token, or None if the token is invalid.
+    Verified tokens and loaded users are cached briefly, so repeated requests
+    with the same token skip both the signature check and the user query.
+    """
+    user_id = auth_cache.get_token_subject(token)
+    
+    if user_id is None:
+        try:
+            payload = jwt.decode(token, settings.app_secret_key, algorithms=[ALGORITHM])
+        except jwt.InvalidTokenError:
+            return None
+        
+        user_id = payload.get("sub")
+        if user_id is None:
+            return None
+        
+        auth_cache.cache_token_subject(token, user_id, payload.get("exp"))
+    
+    user = auth_cache.get_user(user_id)
+    
+    if user is None:
+        result = await db.execute(select(User).where(User.id == user_id))
+        user = result.scalar_one_or_none()
+        
+        if user is None:
+            return None
+        
+        # Detach so the cached instance is unaffected by this session's rollbacks
+        db.expunge(user)
+        auth_cache.cache_user(user)
+    
+    return user
+
+
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: AsyncSession = Depends(get_db)
@@ -49,18 +126,7 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, settings.app_secret_key, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    # Fetch user from database
-    result = await db.execute(select(User).where(User.id == user_id))
-    user = result.scalar_one_or_none()
+    user = await get_user_from_token(credentials.credentials, db)
     
     if user is None:
         raise credentials_exception
@@ -84,39 +150,50 @@ async def get_user_from_api_key(
         )
     
     # Hash the provided API key
-    key_hash = hashlib.sha256(x_api_key.encode()).hexdigest()
+    key_hash = hash_api_key(x_api_key)
     
-    # Find the API key in database
-    result = await db.execute(
-        select(APIKey).where(APIKey.key_hash == key_hash)
-    )
-    api_key = result.scalar_one_or_none()
+    cached = auth_cache.get_api_key(key_hash)
     
-    if not api_key:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid API key",
-        )
+    if cached is not None and cached[1].expires_at > datetime.now(timezone.utc):
+        return cached
     
-    # Check if key is active
-    if not api_key.is_active:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="API key has been revoked",
+    # Find a usable API key and its owner in a single round-trip
+    result = await db.execute(
+        select(APIKey, User)
+        .outerjoin(User, User.id == APIKey.user_id)
+        .where(
+            APIKey.key_hash == key_hash,
+            APIKey.is_active == True,
+            APIKey.expires_at > func.now(),
         )
+    )
+    row = result.one_or_none()
     
-    # Check if key is expired
-    if api_key.expires_at < datetime.now(timezone.utc):
+    if not row:
+        # Rare path: look the key up again to report why it was rejected
+        status_result = await db.execute(
+            select(APIKey.is_active).where(APIKey.key_hash == key_hash)
+        )
+        is_active = status_result.scalar_one_or_none()
+        
+        if is_active is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid API key",
+            )
+        
+        if not is_active:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="API key has been revoked",
+            )
+        
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="API key has expired",
         )
     
-    # Fetch the user
-    user_result = await db.execute(
-        select(User).where(User.id == api_key.user_id)
-    )
-    user = user_result.scalar_one_or_none()
+    api_key, user = row
     
     if not user:
         raise HTTPException(
@@ -124,10 +201,47 @@ async def get_user_from_api_key(
             detail="User not found",
         )
     
+    db.expunge(api_key)
+    db.expunge(user)
+    auth_cache.cache_api_key(key_hash, user, api_key)
+    
     return user, api_key
 
 
+async def authenticate_request(
+    request: Request,
+    db: AsyncSession,
+    authorization: Optional[str],
+    x_api_key: Optional[str]
+) -> Optional[tuple[User, Optional[APIKey]]]:
+    """
+    Resolve the caller from a JWT (checked first) or an API key.
+    Returns (user, api_key), with api_key None for JWT callers, or None if
+    no credentials were given. The result is kept on request.state so
+    several auth dependencies on one request only authenticate once.
+    """
+    cached = getattr(request.state, "auth", None)
+    if cached is not None:
+        return cached
+    
+    auth = None
+    
+    token = extract_bearer_token(authorization)
+    if token:
+        user = await get_user_from_token(token, db)
+        if user:
+            auth = (user, None)
+    
+    if auth is None and x_api_key:
+        auth = await get_user_from_api_key(x_api_key, db)
+    
+    if auth is not None:
+        request.state.auth = auth
+    return auth
+
+
 async def get_current_user_flexible(
+    request: Request,
     db: AsyncSession = Depends(get_db),
     authorization: Optional[str] = Header(None),
     x_api_key: Optional[str] = Header(None)
@@ -137,24 +251,9 @@ async def get_current_user_flexible(
     Checks Authorization header first (JWT), then X-API-Key header.
     Use this for endpoints that accept both authentication methods.
     """
-    # Try JWT first
-    if authorization and authorization.startswith("Bearer "):
-        token = authorization.replace("Bearer ", "")
-        try:
-            payload = jwt.decode(token, settings.app_secret_key, algorithms=[ALGORITHM])
-            user_id: str = payload.get("sub")
-            if user_id:
-                result = await db.execute(select(User).where(User.id == user_id))
-                user = result.scalar_one_or_none()
-                if user:
-                    return user
-        except JWTError:
-            pass
-    
-    # Try API Key
-    if x_api_key:
-        user, _ = await get_user_from_api_key(x_api_key, db)
-        return user
+    auth = await authenticate_request(request, db, authorization, x_api_key)
+    if auth:
+        return auth[0]
     
     # No valid authentication provided
     raise HTTPException(
@@ -164,48 +263,40 @@ async def get_current_user_flexible(
     )
 
 
+@lru_cache(maxsize=None)
 def require_permission(required_permission: str):
     """
     Dependency factory to check if user has specific permission via API key.
     Only validates permissions if request uses API key authentication.
     JWT users have all permissions by default.
+    
+    Returns the same checker for the same permission, so FastAPI can reuse
+    its result when it appears more than once in a request's dependencies.
     """
     async def permission_checker(
+        request: Request,
         db: AsyncSession = Depends(get_db),
         authorization: Optional[str] = Header(None),
         x_api_key: Optional[str] = Header(None)
     ) -> User:
-        # If using JWT, grant all permissions
-        if authorization and authorization.startswith("Bearer "):
-            token = authorization.replace("Bearer ", "")
-            try:
-                payload = jwt.decode(token, settings.app_secret_key, algorithms=[ALGORITHM])
-                user_id: str = payload.get("sub")
-                if user_id:
-                    result = await db.execute(select(User).where(User.id == user_id))
-                    user = result.scalar_one_or_none()
-                    if user:
-                        return user
-            except JWTError:
-                pass
+        auth = await authenticate_request(request, db, authorization, x_api_key)
         
-        # If using API key, check permissions
-        if x_api_key:
-            user, api_key = await get_user_from_api_key(x_api_key, db)
-            
-            if required_permission not in api_key.permissions:
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail=f"API key does not have '{required_permission}' permission",
-                )
-            
-            return user
+        if not auth:
+            # No valid authentication
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Authentication required",
+            )
         
-        # No valid authentication
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Authentication required",
-        )
+        user, api_key = auth
+        
+        # JWT users have every permission; API keys only their own
+        if api_key is not None and required_permission not in api_key.permissions:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"API key does not have '{required_permission}' permission",
+            )
+        
+        return user
     
     return permission_checker
-
@@ -0,0 +1,101 @@
+"""
+Optional Redis cache for wallet balances.
+
+Enabled when REDIS_URL is set; otherwise every balance read goes to
+Postgres. Each user has a generation counter next to the cached value.
+Writers bump it and drop the entry after a credit or debit commits, and
+a reader only fills the cache if the generation is unchanged since it
+looked, so a balance read before a concurrent write is never cached
+after it. If an invalidation itself fails, a stale entry can survive
+until the short TTL expires. Redis errors are logged and treated as
+cache misses.
+"""
+import logging
+from typing import Optional
+
+import redis.asyncio as redis
+
+from app.config import settings
+
+BALANCE_CACHE_TTL_SECONDS = 60
+# Generations only need to outlive any in-flight fill; a day is plenty
+BALANCE_GENERATION_TTL_SECONDS = 24 * 60 * 60
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[redis.Redis] = None
+
+
+def _key(user_id: str) -> str:
+    return f"bal:{user_id}"
+
+
+def _generation_key(user_id: str) -> str:
+    return f"balgen:{user_id}"
+
+
+def connect() -> None:
+    """Create the shared Redis client if a URL is configured"""
+    global _client
+    if settings.redis_url:
+        _client = redis.from_url(settings.redis_url)
+
+
+async def close() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def get_balance(user_id: str) -> tuple[Optional[int], Optional[bytes]]:
+    """
+    Return the cached balance (or None) and a fill token.
+
+    Pass the token to cache_balance after reading the database; None
+    means the cache could not be read and must not be filled.
+    """
+    if _client is None:
+        return None, None
+    try:
+        value, generation = await _client.mget(_key(user_id), _generation_key(user_id))
+    except redis.RedisError:
+        logger.warning("Balance cache read failed", exc_info=True)
+        return None, None
+    balance = int(value) if value is not None else None
+    return balance, generation or b""
+
+
+async def cache_balance(user_id: str, balance: int, token: Optional[bytes]) -> None:
+    """Cache a balance just read from the database, unless a write raced it"""
+    if _client is None or token is None:
+        return
+    generation_key = _generation_key(user_id)
+    try:
+        async with _client.pipeline() as pipe:
+            await pipe.watch(generation_key)
+            if (await pipe.get(generation_key) or b"") != token:
+                return
+            pipe.multi()
+            pipe.set(_key(user_id), balance, ex=BALANCE_CACHE_TTL_SECONDS)
+            await pipe.execute()
+    except redis.WatchError:
+        # A writer bumped the generation mid-fill; leave the entry empty
+        pass
+    except redis.RedisError:
+        logger.warning("Balance cache write failed", exc_info=True)
+
+
+async def invalidate(*user_ids: str) -> None:
+    """Bump generations and drop cached balances after a committed credit or debit"""
+    if _client is None or not user_ids:
+        return
+    try:
+        async with _client.pipeline(transaction=True) as pipe:
+            for user_id in user_ids:
+                pipe.incr(_generation_key(user_id))
+                pipe.expire(_generation_key(user_id), BALANCE_GENERATION_TTL_SECONDS)
+            pipe.delete(*(_key(user_id) for user_id in user_ids))
+            await pipe.execute()
+    except redis.RedisError:
+        logger.warning("Balance cache invalidation failed", exc_info=True)
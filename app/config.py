@@ -1,9 +1,23 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings
 
 
 class Settings(BaseSettings):
     # Database
     database_url: str
+    # Per worker process: keep workers * (pool size + overflow) under the
+    # server's max_connections (100 by default), leaving room for other clients
+    db_pool_size: int = 20
+    db_max_overflow: int = 10
+    db_statement_cache_size: int = 512
+    db_pool_pre_ping: bool = True
+    db_pool_recycle_seconds: int = 1800
+    # Set when connecting through PgBouncer in transaction pooling mode
+    db_pgbouncer: bool = False
+
+    # Redis, optional; enables the shared wallet balance cache
+    redis_url: Optional[str] = None
     
     # Google OAuth
     google_client_id: str
@@ -13,6 +27,8 @@ class Settings(BaseSettings):
     # Paystack
     paystack_secret_key: str
     paystack_webhook_secret: str
+    # Processed webhook event ids are kept this long to catch redeliveries
+    webhook_event_retention_days: int = 7
     
     # Application
     app_secret_key: str
@@ -26,6 +42,18 @@ class Settings(BaseSettings):
         if self.database_url.startswith("postgresql://"):
             return self.database_url.replace("postgresql://", "postgresql+asyncpg://", 1)
         return self.database_url
+    
+    def get_engine_connect_args(self) -> dict:
+        """Driver options for the async engine (asyncpg statement caches)"""
+        if not self.get_async_database_url().startswith("postgresql+asyncpg://"):
+            return {}
+        # Prepared statements don't survive PgBouncer handing the server
+        # connection to another client between transactions
+        cache_size = 0 if self.db_pgbouncer else self.db_statement_cache_size
+        return {
+            "prepared_statement_cache_size": cache_size,
+            "statement_cache_size": cache_size,
+        }
 
 
 settings = Settings()
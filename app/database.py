@@ -1,9 +1,21 @@
+import asyncio
+
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.config import settings
 
-engine = create_async_engine(settings.get_async_database_url(), echo=True, future=True)
+engine = create_async_engine(
+    settings.get_async_database_url(),
+    echo=True,
+    future=True,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_pre_ping=settings.db_pool_pre_ping,
+    pool_recycle=settings.db_pool_recycle_seconds,
+    connect_args=settings.get_engine_connect_args(),
+)
 async_session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 Base = declarative_base()
@@ -17,6 +29,56 @@ async def get_db():
             await session.close()
 
 
+# Indexes since removed from the models, dropped from existing databases
+_OBSOLETE_INDEXES = (
+    "api_keys_key_hash_active_idx",
+    "api_keys_keyhash_cover_idx",
+)
+
+
+# Serialises schema changes across workers starting at the same time
+_SCHEMA_LOCK_ID = 0x77616C6C6574
+_SCHEMA_LOCK_POLL_SECONDS = 0.5
+
+_INVALID_INDEXES = text(
+    "SELECT c.relname FROM pg_index i"
+    " JOIN pg_class c ON c.oid = i.indexrelid"
+    " JOIN pg_namespace n ON n.oid = c.relnamespace"
+    " WHERE n.nspname = current_schema() AND NOT i.indisvalid"
+)
+
+
+def _create_missing_indexes(conn):
+    """create_all only builds indexes with new tables; add any declared since"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
 async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    """
+    Create missing tables and indexes, and drop obsolete ones.
+
+    Runs outside a transaction so indexes on existing tables are built and
+    dropped CONCURRENTLY, without blocking writes; an advisory lock keeps
+    workers booting together from racing each other. Once the schema is
+    current this only reads the catalog.
+    """
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        # Poll rather than block: a session waiting inside pg_advisory_lock
+        # holds a snapshot that CREATE INDEX CONCURRENTLY would wait on
+        while not await conn.scalar(
+            text("SELECT pg_try_advisory_lock(:id)"), {"id": _SCHEMA_LOCK_ID}
+        ):
+            await asyncio.sleep(_SCHEMA_LOCK_POLL_SECONDS)
+        try:
+            await conn.run_sync(Base.metadata.create_all)
+            # A failed concurrent build leaves an invalid index behind; drop
+            # it so it is rebuilt below
+            invalid = (await conn.scalars(_INVALID_INDEXES)).all()
+            for index_name in (*_OBSOLETE_INDEXES, *invalid):
+                await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+            await conn.run_sync(_create_missing_indexes)
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": _SCHEMA_LOCK_ID})
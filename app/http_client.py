@@ -0,0 +1,47 @@
+"""
+Shared outbound HTTP client.
+
+One pooled client is created for the application's lifetime so calls to
+third-party APIs reuse keep-alive connections instead of paying a fresh
+TCP + TLS handshake per request.
+"""
+import httpx
+from fastapi import Request
+
+from app.config import settings
+
+PAYSTACK_BASE_URL = "https://api.paystack.co"
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Create the pooled client used for outbound calls (e.g. Google OAuth)"""
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=10.0,
+        limits=httpx.Limits(max_keepalive_connections=50, max_connections=200),
+    )
+
+
+def create_paystack_client() -> httpx.AsyncClient:
+    """Create the pooled client for the Paystack API, authenticated with the secret key"""
+    return httpx.AsyncClient(
+        base_url=PAYSTACK_BASE_URL,
+        headers={"Authorization": f"Bearer {settings.paystack_secret_key}"},
+        http2=True,
+        timeout=httpx.Timeout(10.0, connect=5.0),
+        limits=httpx.Limits(
+            max_keepalive_connections=100,
+            max_connections=200,
+            keepalive_expiry=30.0,
+        ),
+    )
+
+
+def get_http_client(request: Request) -> httpx.AsyncClient:
+    """Dependency returning the application's shared HTTP client"""
+    return request.app.state.http_client
+
+
+def get_paystack_client(request: Request) -> httpx.AsyncClient:
+    """Dependency returning the application's shared Paystack client"""
+    return request.app.state.paystack_client
@@ -0,0 +1,29 @@
+"""
+Identifier generation for primary keys
+"""
+import os
+import time
+import uuid
+
+
+def uuid7() -> str:
+    """
+    Generate a time-ordered UUIDv7 (RFC 9562) as a string.
+    v7 ids are ordered among themselves by creation time, so successive
+    inserts land next to each other in the primary-key index instead of on
+    random pages. Rows created earlier with uuid4 ids are spread across the
+    whole keyspace, so new ids do not sort after those.
+    """
+    unix_ts_ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), "big")
+    rand_a = rand >> 68                # 12 random bits
+    rand_b = rand & ((1 << 62) - 1)    # 62 random bits
+    
+    value = (
+        (unix_ts_ms & 0xFFFF_FFFF_FFFF) << 80
+        | 0x7 << 76     # version
+        | rand_a << 64
+        | 0b10 << 62    # RFC 4122 variant
+        | rand_b
+    )
+    return str(uuid.UUID(int=value))
@@ -1,23 +1,50 @@
+import asyncio
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+import contextlib
 from contextlib import asynccontextmanager
 
-from app.database import init_db
+from app import balance_cache
+from app.auth_utils import check_hash_acceleration
+from app.database import engine, init_db
+from app.http_client import create_http_client, create_paystack_client
 from app.routers import auth, api_keys, wallet
+from app.services.paystack import (
+    WEBHOOK_QUEUE_MAX_SIZE, run_paystack_event_worker, run_processed_event_pruner
+)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup: Initialize database
     await init_db()
+    check_hash_acceleration()
+    app.state.http_client = create_http_client()
+    app.state.paystack_client = create_paystack_client()
+    balance_cache.connect()
+    app.state.paystack_events = asyncio.Queue(maxsize=WEBHOOK_QUEUE_MAX_SIZE)
+    event_worker = asyncio.create_task(run_paystack_event_worker(app.state.paystack_events))
+    event_pruner = asyncio.create_task(run_processed_event_pruner())
     yield
-    # Shutdown: cleanup if needed
+    # Shutdown: settle queued webhook events, then close pooled connections
+    event_pruner.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await event_pruner
+    await app.state.paystack_events.put(None)
+    await event_worker
+    await app.state.paystack_client.aclose()
+    await app.state.http_client.aclose()
+    await balance_cache.close()
+    await engine.dispose()
 
 
 app = FastAPI(
     title="HNG Stage 9 - Wallet Service",
     description="Backend API for Wallet Management with Google Sign-In, API Keys, and Paystack Integration",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
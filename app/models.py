@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, DateTime, Enum as SQLEnum, Boolean, JSON
+from sqlalchemy import Column, String, Integer, DateTime, Enum as SQLEnum, Boolean, JSON, Index
 from sqlalchemy.sql import func
 from datetime import datetime
 import enum
@@ -35,6 +35,17 @@ class Transaction(Base):
     paid_at = Column(DateTime(timezone=True), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    
+    __table_args__ = (
+        # Deposit history, already in the order the history query sorts by
+        Index(
+            "transactions_user_status_ts_idx",
+            "user_id",
+            "status",
+            func.coalesce(paid_at, created_at).desc(),
+            postgresql_concurrently=True,
+        ),
+    )
 
 
 class APIKey(Base):
@@ -43,12 +54,23 @@ class APIKey(Base):
     id = Column(String, primary_key=True, index=True)
     user_id = Column(String, nullable=False, index=True)
     name = Column(String, nullable=False)
-    key_hash = Column(String, unique=True, nullable=False)  # Hashed API key
+    key_hash = Column(String, unique=True, nullable=False)  # Hashed API key; the unique index serves auth lookups
     permissions = Column(JSON, nullable=False)  # Store as JSON array
     expires_at = Column(DateTime(timezone=True), nullable=False)
     is_active = Column(Boolean, default=True, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     revoked_at = Column(DateTime(timezone=True), nullable=True)
+    
+    __table_args__ = (
+        # Active-key count when creating or rolling over keys
+        Index(
+            "api_keys_user_active_idx",
+            "user_id",
+            "expires_at",
+            postgresql_where=is_active,
+            postgresql_concurrently=True,
+        ),
+    )
 
 
 class Wallet(Base):
@@ -70,5 +92,28 @@ class Transfer(Base):
     amount = Column(Integer, nullable=False)  # Amount in kobo
     status = Column(SQLEnum(TransactionStatus), default=TransactionStatus.SUCCESS, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    __table_args__ = (
+        # Sent-transfer history, newest first
+        Index(
+            "transfers_sender_created_idx",
+            "sender_id",
+            created_at.desc(),
+            postgresql_concurrently=True,
+        ),
+    )
 
 
+class ProcessedWebhookEvent(Base):
+    __tablename__ = "processed_webhook_events"
+    
+    event_id = Column(String, primary_key=True)  # e.g. "charge.success:<paystack transaction id>"
+    received_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)  # For retention pruning
+
+
+class PendingWebhookEvent(Base):
+    __tablename__ = "pending_webhook_events"
+    
+    event_id = Column(String, primary_key=True)  # Same format as ProcessedWebhookEvent.event_id
+    reference = Column(String, nullable=False)
+    received_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)  # Oldest first when draining
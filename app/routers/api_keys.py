@@ -2,11 +2,13 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 from datetime import datetime, timedelta, timezone
-import secrets
-import hashlib
-import uuid
+from typing import Optional
+import base64
+import os
 
+from app import auth_cache
 from app.database import get_db
+from app.ids import uuid7
 from app.models import APIKey, User
 from app.schemas import (
     APIKeyCreateRequest,
@@ -14,27 +16,33 @@ from app.schemas import (
     APIKeyRolloverRequest,
     APIKeyRolloverResponse
 )
-from app.auth_utils import get_current_user
+from app.auth_utils import get_current_user, hash_api_key
 
 router = APIRouter(prefix="/keys", tags=["API Keys"])
 
 
-def parse_expiry(expiry: str) -> datetime:
+API_KEY_PREFIX = "sk_live_"
+
+# Supported expiry codes
+EXPIRY_DELTAS = {
+    "1H": timedelta(hours=1),
+    "1D": timedelta(days=1),
+    "1M": timedelta(days=30),
+    "1Y": timedelta(days=365),
+}
+
+
+def parse_expiry(expiry: str, now: Optional[datetime] = None) -> datetime:
     """
     Convert expiry string (1H, 1D, 1M, 1Y) to datetime.
+    Pass `now` to reuse a timestamp the caller has already taken.
     """
-    now = datetime.now(timezone.utc)
+    delta = EXPIRY_DELTAS.get(expiry)
     
-    if expiry == "1H":
-        return now + timedelta(hours=1)
-    elif expiry == "1D":
-        return now + timedelta(days=1)
-    elif expiry == "1M":
-        return now + timedelta(days=30)
-    elif expiry == "1Y":
-        return now + timedelta(days=365)
-    else:
+    if delta is None:
         raise ValueError(f"Invalid expiry format: {expiry}")
+    
+    return (now or datetime.now(timezone.utc)) + delta
 
 
 def generate_api_key() -> tuple[str, str]:
@@ -42,12 +50,12 @@ def generate_api_key() -> tuple[str, str]:
     Generate a secure API key and its hash.
     Returns: (api_key, key_hash)
     """
-    # Generate random API key with prefix
-    random_part = secrets.token_urlsafe(32)
-    api_key = f"sk_live_{random_part}"
+    # Generate random API key with prefix (same encoding as secrets.token_urlsafe)
+    random_part = base64.urlsafe_b64encode(os.urandom(32)).rstrip(b"=").decode("ascii")
+    api_key = API_KEY_PREFIX + random_part
     
     # Hash the key for storage
-    key_hash = hashlib.sha256(api_key.encode()).hexdigest()
+    key_hash = hash_api_key(api_key)
     
     return api_key, key_hash
 
@@ -66,12 +74,14 @@ async def create_api_key(
     - Permissions must be explicitly assigned
     - Expiry is converted to datetime and stored
     """
+    now = datetime.now(timezone.utc)
+    
     # Check active keys count
     active_keys_count = await db.execute(
         select(func.count(APIKey.id)).where(
             APIKey.user_id == current_user.id,
             APIKey.is_active == True,
-            APIKey.expires_at > datetime.now(timezone.utc)
+            APIKey.expires_at > now
         )
     )
     count = active_keys_count.scalar()
@@ -84,7 +94,7 @@ async def create_api_key(
     
     # Parse expiry
     try:
-        expires_at = parse_expiry(request.expiry)
+        expires_at = parse_expiry(request.expiry, now)
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -96,7 +106,7 @@ async def create_api_key(
     
     # Create API key record
     new_key = APIKey(
-        id=str(uuid.uuid4()),
+        id=uuid7(),
         user_id=current_user.id,
         name=request.name,
         key_hash=key_hash,
@@ -170,7 +180,7 @@ async def rollover_api_key(
     
     # Parse new expiry
     try:
-        expires_at = parse_expiry(request.expiry)
+        expires_at = parse_expiry(request.expiry, now)
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -182,7 +192,7 @@ async def rollover_api_key(
     
     # Reuse permissions from expired key
     new_key = APIKey(
-        id=str(uuid.uuid4()),
+        id=uuid7(),
         user_id=current_user.id,
         name=expired_key.name,
         key_hash=key_hash,
@@ -195,6 +205,9 @@ async def rollover_api_key(
     await db.commit()
     await db.refresh(new_key)
     
+    # The old key must stop authenticating immediately
+    auth_cache.invalidate_api_key(expired_key.key_hash)
+    
     return APIKeyRolloverResponse(
         api_key=api_key,
         expires_at=expires_at
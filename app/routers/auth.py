@@ -1,16 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.responses import RedirectResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 import httpx
+import jwt
+from typing import Optional
 from urllib.parse import urlencode
-import uuid
 
 from app.database import get_db
+from app.ids import uuid7
 from app.models import User
 from app.schemas import GoogleAuthURLResponse, GoogleCallbackResponse
 from app.config import settings
 from app.auth_utils import create_access_token
+from app.http_client import get_http_client
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
@@ -18,6 +22,37 @@ router = APIRouter(prefix="/auth", tags=["Authentication"])
 GOOGLE_AUTH_URL = "https://accounts.google.com/o/oauth2/v2/auth"
 GOOGLE_TOKEN_URL = "https://oauth2.googleapis.com/token"
 GOOGLE_USERINFO_URL = "https://www.googleapis.com/oauth2/v2/userinfo"
+GOOGLE_ISSUERS = ("https://accounts.google.com", "accounts.google.com")
+
+
+def user_info_from_id_token(id_token: Optional[str]) -> Optional[dict]:
+    """
+    Extract the profile from the ID token returned by Google's token endpoint.
+    The token is received directly from Google over TLS, so its signature does
+    not need to be re-verified (OpenID Connect Core 3.1.3.7); audience and
+    issuer are still checked. Returns None if the token is missing or unusable.
+    """
+    if not id_token:
+        return None
+    
+    try:
+        claims = jwt.decode(id_token, options={"verify_signature": False})
+    except jwt.InvalidTokenError:
+        return None
+    
+    if claims.get("aud") != settings.google_client_id or claims.get("iss") not in GOOGLE_ISSUERS:
+        return None
+    
+    if not claims.get("sub") or not claims.get("email"):
+        return None
+    
+    # Same shape as the userinfo response; the OIDC "sub" is Google's user id
+    return {
+        "id": claims["sub"],
+        "email": claims["email"],
+        "name": claims.get("name"),
+        "picture": claims.get("picture")
+    }
 
 
 @router.get("/google", response_model=GoogleAuthURLResponse)
@@ -48,7 +83,11 @@ async def google_signin():
 
 
 @router.get("/google/callback", response_model=GoogleCallbackResponse)
-async def google_callback(code: str = None, db: AsyncSession = Depends(get_db)):
+async def google_callback(
+    code: str = None,
+    db: AsyncSession = Depends(get_db),
+    client: httpx.AsyncClient = Depends(get_http_client)
+):
     """
     Google OAuth callback endpoint.
     Exchanges the code for access token and creates/updates user in database.
@@ -61,34 +100,37 @@ async def google_callback(code: str = None, db: AsyncSession = Depends(get_db)):
     
     try:
         # Step 1: Exchange code for access token
-        async with httpx.AsyncClient() as client:
-            token_response = await client.post(
-                GOOGLE_TOKEN_URL,
-                data={
-                    "code": code,
-                    "client_id": settings.google_client_id,
-                    "client_secret": settings.google_client_secret,
-                    "redirect_uri": settings.google_redirect_uri,
-                    "grant_type": "authorization_code"
-                }
+        token_response = await client.post(
+            GOOGLE_TOKEN_URL,
+            data={
+                "code": code,
+                "client_id": settings.google_client_id,
+                "client_secret": settings.google_client_secret,
+                "redirect_uri": settings.google_redirect_uri,
+                "grant_type": "authorization_code"
+            }
+        )
+        
+        if token_response.status_code != 200:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid authorization code"
             )
-            
-            if token_response.status_code != 200:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Invalid authorization code"
-                )
-            
-            token_data = token_response.json()
-            access_token = token_data.get("access_token")
-            
-            if not access_token:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Failed to obtain access token"
-                )
-            
-            # Step 2: Fetch user info from Google
+        
+        token_data = token_response.json()
+        access_token = token_data.get("access_token")
+        
+        if not access_token:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Failed to obtain access token"
+            )
+        
+        # Step 2: Read user info from the ID token, saving a round-trip to Google
+        user_info = user_info_from_id_token(token_data.get("id_token"))
+        
+        if user_info is None:
+            # Fall back to fetching user info from Google
             userinfo_response = await client.get(
                 GOOGLE_USERINFO_URL,
                 headers={"Authorization": f"Bearer {access_token}"}
@@ -101,55 +143,56 @@ async def google_callback(code: str = None, db: AsyncSession = Depends(get_db)):
                 )
             
             user_info = userinfo_response.json()
-            
-            # Step 3: Create or update user in database
-            google_id = user_info.get("id")
-            email = user_info.get("email")
-            name = user_info.get("name")
-            picture = user_info.get("picture")
-            
-            if not google_id or not email:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Incomplete user info from Google"
-                )
-            
-            # Check if user exists
-            result = await db.execute(select(User).where(User.google_id == google_id))
-            existing_user = result.scalar_one_or_none()
-            
-            if existing_user:
-                # Update existing user
-                existing_user.email = email
-                existing_user.name = name
-                existing_user.picture = picture
-                user = existing_user
-            else:
-                # Create new user
-                user = User(
-                    id=str(uuid.uuid4()),
-                    google_id=google_id,
-                    email=email,
-                    name=name,
-                    picture=picture
-                )
-                db.add(user)
-            
-            await db.commit()
-            await db.refresh(user)
-            
-            # Create JWT token for the user
-            access_token = create_access_token(
-                data={"sub": user.id, "email": user.email}
-            )
-            
-            return GoogleCallbackResponse(
-                user_id=user.id,
-                email=user.email,
-                name=user.name,
-                access_token=access_token,
-                token_type="bearer"
+        
+        # Step 3: Create or update user in database
+        google_id = user_info.get("id")
+        email = user_info.get("email")
+        name = user_info.get("name")
+        picture = user_info.get("picture")
+        
+        if not google_id or not email:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Incomplete user info from Google"
             )
+        
+        # Create or update the user in a single round-trip
+        insert_stmt = pg_insert(User).values(
+            id=uuid7(),
+            google_id=google_id,
+            email=email,
+            name=name,
+            picture=picture
+        )
+        upsert_stmt = insert_stmt.on_conflict_do_update(
+            index_elements=[User.google_id],
+            set_={
+                "email": insert_stmt.excluded.email,
+                "name": insert_stmt.excluded.name,
+                "picture": insert_stmt.excluded.picture,
+                "updated_at": func.now()
+            }
+        ).returning(User)
+        
+        result = await db.scalars(
+            upsert_stmt,
+            execution_options={"populate_existing": True}
+        )
+        user = result.one()
+        await db.commit()
+        
+        # Create JWT token for the user
+        access_token = create_access_token(
+            data={"sub": user.id, "email": user.email}
+        )
+        
+        return GoogleCallbackResponse(
+            user_id=user.id,
+            email=user.email,
+            name=user.name,
+            access_token=access_token,
+            token_type="bearer"
+        )
     
     except HTTPException:
         raise
@@ -1,15 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request, Header
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response, Header, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update, func, bindparam, literal, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 import httpx
-import uuid
-import hmac
-import hashlib
-import json
+import orjson
 from typing import Optional
-from datetime import datetime, timezone
 
+from app import balance_cache
 from app.database import get_db
+from app.ids import uuid7
 from app.models import Transaction, TransactionStatus, User, Wallet, Transfer
 from app.schemas import (
     PaymentInitiateRequest,
@@ -21,20 +20,91 @@ from app.schemas import (
     WalletTransferResponse,
     TransactionHistoryItem
 )
-from app.config import settings
 from app.auth_utils import require_permission
+from app.http_client import get_paystack_client
+from app.services import paystack
 
 router = APIRouter(prefix="/wallet", tags=["Wallet"])
 
-# Paystack API URLs
-PAYSTACK_INITIALIZE_URL = "https://api.paystack.co/transaction/initialize"
+
+def _json_response(content, status_code: int = status.HTTP_200_OK) -> Response:
+    """
+    Serialize a response body directly. FastAPI returns a Response as is,
+    skipping the dump and re-validation against response_model, which is
+    still declared for the docs. Z-suffixed UTC times match pydantic's output.
+    """
+    return Response(
+        orjson.dumps(content, option=orjson.OPT_UTC_Z),
+        status_code=status_code,
+        media_type="application/json",
+    )
+
+
+# Statements built once at import and reused with bound parameters
+_TX_STATUS_BY_REF = select(
+    Transaction.reference,
+    Transaction.status,
+    Transaction.amount,
+    Transaction.paid_at
+).where(Transaction.reference == bindparam("reference"))
+
+# Each branch takes its own newest `limit` rows straight off its index, so
+# the final sort only ever sees at most twice `limit` rows
+_deposit_ts = func.coalesce(Transaction.paid_at, Transaction.created_at)
+_history = union_all(
+    select(
+        literal("deposit").label("type"),
+        Transaction.amount,
+        Transaction.status,
+        _deposit_ts.label("timestamp")
+    ).where(
+        Transaction.user_id == bindparam("user_id"),
+        Transaction.status == TransactionStatus.SUCCESS
+    ).order_by(_deposit_ts.desc()).limit(bindparam("limit")),
+    select(
+        literal("transfer").label("type"),
+        Transfer.amount,
+        Transfer.status,
+        Transfer.created_at.label("timestamp")
+    ).where(
+        Transfer.sender_id == bindparam("user_id")
+    ).order_by(Transfer.created_at.desc()).limit(bindparam("limit"))
+).subquery("history")
+_HISTORY_BY_USER = (
+    select(_history)
+    .order_by(_history.c.timestamp.desc())
+    .limit(bindparam("limit"))
+)
+
+_WALLET_BALANCE_BY_USER = select(Wallet.balance).where(Wallet.user_id == bindparam("user_id"))
+
+_USER_ID_BY_ID = select(User.id).where(User.id == bindparam("user_id"))
+
+# Bind names differ from the wallet columns, which UPDATE reserves for SET
+_DEBIT_WALLET = (
+    update(Wallet)
+    .where(Wallet.user_id == bindparam("owner_id"), Wallet.balance >= bindparam("amount"))
+    .values(balance=Wallet.balance - bindparam("amount"))
+    .returning(Wallet.id)
+)
+
+_CREDIT_WALLET = (
+    update(Wallet)
+    .where(Wallet.user_id == bindparam("owner_id"))
+    .values(balance=Wallet.balance + bindparam("amount"))
+    .returning(Wallet.id)
+)
+
+HISTORY_DEFAULT_LIMIT = 100
+HISTORY_MAX_LIMIT = 1000
 
 
 @router.post("/deposit", response_model=PaymentInitiateResponse, status_code=status.HTTP_201_CREATED)
 async def wallet_deposit(
     payment_request: PaymentInitiateRequest,
     current_user: User = Depends(require_permission("deposit")),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    client: httpx.AsyncClient = Depends(get_paystack_client)
 ):
     """
     Initiate a wallet deposit via Paystack.
@@ -56,67 +126,14 @@ async def wallet_deposit(
                 detail="Amount must be greater than 0"
             )
         
-        # Generate unique reference
-        reference = f"txn_{uuid.uuid4().hex}"
-        
-        # Check if reference already exists (idempotency)
-        result = await db.execute(select(Transaction).where(Transaction.reference == reference))
-        existing_transaction = result.scalar_one_or_none()
-        
-        if existing_transaction:
-            return PaymentInitiateResponse(
-                reference=existing_transaction.reference,
-                authorization_url=existing_transaction.authorization_url
-            )
+        reference, authorization_url = await paystack.initiate_transaction(
+            client, db, current_user, payment_request.amount
+        )
         
-        # Call Paystack Initialize Transaction API
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                PAYSTACK_INITIALIZE_URL,
-                headers={
-                    "Authorization": f"Bearer {settings.paystack_secret_key}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "amount": payment_request.amount,
-                    "email": current_user.email,  # Email from authenticated user
-                    "reference": reference,
-                    "currency": "NGN"
-                }
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=status.HTTP_402_PAYMENT_REQUIRED,
-                    detail=f"Payment initiation failed: {response.text}"
-                )
-            
-            paystack_data = response.json()
-            
-            if not paystack_data.get("status"):
-                raise HTTPException(
-                    status_code=status.HTTP_402_PAYMENT_REQUIRED,
-                    detail="Payment initiation failed by Paystack"
-                )
-            
-            authorization_url = paystack_data["data"]["authorization_url"]
-            
-            # Persist transaction in database
-            transaction = Transaction(
-                reference=reference,
-                user_id=current_user.id,
-                amount=payment_request.amount,
-                status=TransactionStatus.PENDING,
-                authorization_url=authorization_url
-            )
-            db.add(transaction)
-            await db.commit()
-            await db.refresh(transaction)
-            
-            return PaymentInitiateResponse(
-                reference=transaction.reference,
-                authorization_url=transaction.authorization_url
-            )
+        return _json_response(
+            {"reference": reference, "authorization_url": authorization_url},
+            status_code=status.HTTP_201_CREATED,
+        )
     
     except HTTPException:
         raise
@@ -130,7 +147,6 @@ async def wallet_deposit(
 @router.post("/paystack/webhook", response_model=WebhookResponse)
 async def paystack_webhook(
     request: Request,
-    db: AsyncSession = Depends(get_db),
     x_paystack_signature: Optional[str] = Header(None)
 ):
     """
@@ -139,81 +155,21 @@ async def paystack_webhook(
     Security: Validates Paystack signature
     Actions:
     - Verify signature
-    - Find transaction by reference
-    - Update transaction status
-    - Credit wallet balance on success
+    - Store the charge, then acknowledge so Paystack does not retry
+    - In the background: update transaction status and
+      credit wallet balance on success
     
     ⚠️ Only this endpoint is allowed to credit wallets.
     """
     try:
-        # Get request body
-        body = await request.body()
+        event = await paystack.read_verified_event(request, x_paystack_signature)
         
-        # Verify Paystack signature
-        if not x_paystack_signature:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Missing Paystack signature"
-            )
-        
-        # Compute expected signature
-        computed_signature = hmac.new(
-            settings.paystack_webhook_secret.encode('utf-8'),
-            body,
-            hashlib.sha512
-        ).hexdigest()
-        
-        if not hmac.compare_digest(computed_signature, x_paystack_signature):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid signature"
-            )
-        
-        # Parse event payload
-        event = json.loads(body)
-        
-        event_type = event.get("event")
-        data = event.get("data", {})
-        
-        # Handle successful charges
-        if event_type == "charge.success":
-            reference = data.get("reference")
-            
-            if reference:
-                # Find transaction in database
-                result = await db.execute(select(Transaction).where(Transaction.reference == reference))
-                transaction = result.scalar_one_or_none()
-                
-                if transaction and transaction.status == TransactionStatus.PENDING:
-                    # Update transaction status
-                    transaction.status = TransactionStatus.SUCCESS
-                    transaction.paid_at = datetime.now(timezone.utc)
-                    
-                    # Credit wallet (create wallet if doesn't exist)
-                    wallet_result = await db.execute(
-                        select(Wallet).where(Wallet.user_id == transaction.user_id)
-                    )
-                    wallet = wallet_result.scalar_one_or_none()
-                    
-                    if not wallet:
-                        # Create wallet for user
-                        wallet = Wallet(
-                            id=str(uuid.uuid4()),
-                            user_id=transaction.user_id,
-                            balance=0
-                        )
-                        db.add(wallet)
-                    
-                    # Credit wallet balance
-                    wallet.balance += transaction.amount
-                    
-                    await db.commit()
+        # Settlement is batched by the event worker after the response is sent
+        charge = paystack.charge_event(event)
+        if charge:
+            await paystack.store_charge(request.app.state.paystack_events, *charge)
         
-        # Note: Paystack doesn't send webhooks for declined/failed transactions
-        # Failed transactions remain as "pending" in the database
-        # Use the status endpoint to check if needed
-        
-        return WebhookResponse(status=True)
+        return _json_response({"status": True})
     
     except HTTPException:
         raise
@@ -238,9 +194,9 @@ async def get_deposit_status(
     Returns current transaction status from database.
     """
     try:
-        # Find transaction in database
-        result = await db.execute(select(Transaction).where(Transaction.reference == reference))
-        transaction = result.scalar_one_or_none()
+        # Find transaction in database (plain row, no ORM object needed)
+        result = await db.execute(_TX_STATUS_BY_REF, {"reference": reference})
+        transaction = result.first()
         
         if not transaction:
             raise HTTPException(
@@ -248,12 +204,12 @@ async def get_deposit_status(
                 detail="Transaction not found"
             )
         
-        return TransactionStatusResponse(
-            reference=transaction.reference,
-            status=transaction.status.value,
-            amount=transaction.amount,
-            paid_at=transaction.paid_at
-        )
+        return _json_response({
+            "reference": transaction.reference,
+            "status": transaction.status.value,
+            "amount": transaction.amount,
+            "paid_at": transaction.paid_at,
+        })
     
     except HTTPException:
         raise
@@ -279,22 +235,25 @@ async def get_wallet_balance(
     Returns balance in kobo.
     """
     try:
-        # Get user's wallet
-        result = await db.execute(select(Wallet).where(Wallet.user_id == current_user.id))
-        wallet = result.scalar_one_or_none()
+        balance, fill_token = await balance_cache.get_balance(current_user.id)
+        if balance is not None:
+            return _json_response({"balance": balance})
+        
+        # Get user's balance (plain column, no ORM object needed)
+        balance = await db.scalar(_WALLET_BALANCE_BY_USER, {"user_id": current_user.id})
         
-        if not wallet:
+        if balance is None:
             # Create wallet if doesn't exist
-            wallet = Wallet(
-                id=str(uuid.uuid4()),
+            db.add(Wallet(
+                id=uuid7(),
                 user_id=current_user.id,
                 balance=0
-            )
-            db.add(wallet)
+            ))
             await db.commit()
-            await db.refresh(wallet)
+            balance = 0
         
-        return WalletBalanceResponse(balance=wallet.balance)
+        await balance_cache.cache_balance(current_user.id, balance, fill_token)
+        return _json_response({"balance": balance})
     
     except HTTPException:
         raise
@@ -331,70 +290,85 @@ async def wallet_transfer(
                 detail="Cannot transfer to your own wallet"
             )
         
-        # Get sender's wallet
-        sender_result = await db.execute(select(Wallet).where(Wallet.user_id == current_user.id))
-        sender_wallet = sender_result.scalar_one_or_none()
+        amount = transfer_request.amount
+        recipient_id = transfer_request.wallet_number
         
-        if not sender_wallet:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Sender wallet not found. Please deposit first."
-            )
+        # Debit only if the balance covers it and credit atomically in SQL
+        # (wallet_number is the user_id). The two rows are updated in user_id
+        # order so opposing transfers can't deadlock
+        debit_params = {"owner_id": current_user.id, "amount": amount}
+        credit_params = {"owner_id": recipient_id, "amount": amount}
+        if current_user.id < recipient_id:
+            debited = (await db.execute(_DEBIT_WALLET, debit_params)).first()
+            credited = (await db.execute(_CREDIT_WALLET, credit_params)).first()
+        else:
+            credited = (await db.execute(_CREDIT_WALLET, credit_params)).first()
+            debited = (await db.execute(_DEBIT_WALLET, debit_params)).first()
         
-        # Check sufficient balance
-        if sender_wallet.balance < transfer_request.amount:
+        if not debited:
+            # Tell a missing wallet apart from insufficient funds
+            available = await db.scalar(
+                _WALLET_BALANCE_BY_USER, {"user_id": current_user.id}
+            )
+            await db.rollback()
+            
+            if available is None:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Sender wallet not found. Please deposit first."
+                )
+            
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Insufficient balance. Available: {sender_wallet.balance} kobo"
+                detail=f"Insufficient balance. Available: {available} kobo"
             )
         
-        # Get recipient's wallet (wallet_number is the user_id)
-        recipient_result = await db.execute(
-            select(Wallet).where(Wallet.user_id == transfer_request.wallet_number)
-        )
-        recipient_wallet = recipient_result.scalar_one_or_none()
-        
-        if not recipient_wallet:
+        if not credited:
             # Check if recipient user exists
-            user_result = await db.execute(
-                select(User).where(User.id == transfer_request.wallet_number)
+            recipient_exists = await db.scalar(
+                _USER_ID_BY_ID, {"user_id": recipient_id}
             )
-            recipient_user = user_result.scalar_one_or_none()
             
-            if not recipient_user:
+            if not recipient_exists:
+                await db.rollback()
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail="Recipient wallet not found"
                 )
             
-            # Create wallet for recipient
-            recipient_wallet = Wallet(
-                id=str(uuid.uuid4()),
-                user_id=recipient_user.id,
-                balance=0
+            # Create wallet for recipient, crediting one created concurrently
+            insert_stmt = pg_insert(Wallet).values(
+                id=uuid7(),
+                user_id=recipient_id,
+                balance=amount
+            )
+            await db.execute(
+                insert_stmt.on_conflict_do_update(
+                    index_elements=[Wallet.user_id],
+                    set_={
+                        "balance": Wallet.balance + insert_stmt.excluded.balance,
+                        "updated_at": func.now()
+                    }
+                )
             )
-            db.add(recipient_wallet)
-        
-        # Perform transfer
-        sender_wallet.balance -= transfer_request.amount
-        recipient_wallet.balance += transfer_request.amount
         
         # Record transfer
         transfer = Transfer(
-            id=str(uuid.uuid4()),
+            id=uuid7(),
             sender_id=current_user.id,
-            recipient_id=transfer_request.wallet_number,
-            amount=transfer_request.amount,
+            recipient_id=recipient_id,
+            amount=amount,
             status=TransactionStatus.SUCCESS
         )
         db.add(transfer)
         
         await db.commit()
+        await balance_cache.invalidate(current_user.id, recipient_id)
         
-        return WalletTransferResponse(
-            status="success",
-            message=f"Transfer of {transfer_request.amount} kobo completed successfully"
-        )
+        return _json_response({
+            "status": "success",
+            "message": f"Transfer of {transfer_request.amount} kobo completed successfully",
+        })
     
     except HTTPException:
         raise
@@ -408,6 +382,7 @@ async def wallet_transfer(
 
 @router.get("/transactions", response_model=list[TransactionHistoryItem])
 async def get_transaction_history(
+    limit: int = Query(HISTORY_DEFAULT_LIMIT, ge=1, le=HISTORY_MAX_LIMIT),
     current_user: User = Depends(require_permission("read")),
     db: AsyncSession = Depends(get_db)
 ):
@@ -418,48 +393,26 @@ async def get_transaction_history(
     - JWT: Send Bearer token in Authorization header
     - API Key: Send API key in X-API-Key header (requires 'read' permission)
     
-    Returns list of deposits and transfers.
+    Returns the most recent deposits and transfers, newest first
+    (up to `limit`, default 100).
     """
     try:
-        history = []
-        
-        # Get deposits (successful transactions)
-        deposits_result = await db.execute(
-            select(Transaction).where(
-                Transaction.user_id == current_user.id,
-                Transaction.status == TransactionStatus.SUCCESS
-            ).order_by(Transaction.created_at.desc())
+        # Successful deposits and sent transfers, merged and sorted by Postgres.
+        # Rows are already typed by the columns, so they are serialized as is
+        result = await db.execute(
+            _HISTORY_BY_USER,
+            {"user_id": current_user.id, "limit": limit}
         )
-        deposits = deposits_result.scalars().all()
-        
-        for deposit in deposits:
-            history.append(TransactionHistoryItem(
-                type="deposit",
-                amount=deposit.amount,
-                status=deposit.status.value,
-                timestamp=deposit.paid_at or deposit.created_at
-            ))
-        
-        # Get sent transfers
-        sent_transfers_result = await db.execute(
-            select(Transfer).where(
-                Transfer.sender_id == current_user.id
-            ).order_by(Transfer.created_at.desc())
-        )
-        sent_transfers = sent_transfers_result.scalars().all()
-        
-        for transfer in sent_transfers:
-            history.append(TransactionHistoryItem(
-                type="transfer",
-                amount=transfer.amount,
-                status=transfer.status.value,
-                timestamp=transfer.created_at
-            ))
-        
-        # Sort by timestamp descending
-        history.sort(key=lambda x: x.timestamp, reverse=True)
         
-        return history
+        return _json_response([
+            {
+                "type": row.type,
+                "amount": row.amount,
+                "status": row.status.value,
+                "timestamp": row.timestamp
+            }
+            for row in result
+        ])
     
     except HTTPException:
         raise
@@ -1,14 +1,22 @@
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from typing import Optional, List
 from datetime import datetime
 
 
+class ResponseModel(BaseModel):
+    """
+    Base for response bodies. They are built once per response and never
+    modified, so instances are frozen and unknown fields are rejected.
+    """
+    model_config = ConfigDict(frozen=True, extra='forbid', from_attributes=True)
+
+
 # Google Auth Schemas
-class GoogleAuthURLResponse(BaseModel):
+class GoogleAuthURLResponse(ResponseModel):
     google_auth_url: str
 
 
-class GoogleCallbackResponse(BaseModel):
+class GoogleCallbackResponse(ResponseModel):
     user_id: str
     email: str
     name: Optional[str] = None
@@ -31,25 +39,28 @@ class PaymentInitiateRequest(BaseModel):
         - 5000 → 5000 kobo (50 NGN)
         - 50.75 → 5075 kobo (50.75 NGN)
         """
+        if type(v) is int:
+            # Common case: already kobo
+            return v
         if isinstance(v, float):
             # Convert naira to kobo (multiply by 100 and round)
             return int(round(v * 100))
         return v
 
 
-class PaymentInitiateResponse(BaseModel):
+class PaymentInitiateResponse(ResponseModel):
     reference: str
     authorization_url: str
 
 
-class TransactionStatusResponse(BaseModel):
+class TransactionStatusResponse(ResponseModel):
     reference: str
     status: str
     amount: int
     paid_at: Optional[datetime] = None
 
 
-class WebhookResponse(BaseModel):
+class WebhookResponse(ResponseModel):
     status: bool
 
 
@@ -69,7 +80,7 @@ class APIKeyCreateRequest(BaseModel):
         return v
 
 
-class APIKeyCreateResponse(BaseModel):
+class APIKeyCreateResponse(ResponseModel):
     api_key: str
     expires_at: datetime
 
@@ -79,13 +90,13 @@ class APIKeyRolloverRequest(BaseModel):
     expiry: str = Field(..., pattern="^(1H|1D|1M|1Y)$", description="Expiry duration: 1H, 1D, 1M, 1Y")
 
 
-class APIKeyRolloverResponse(BaseModel):
+class APIKeyRolloverResponse(ResponseModel):
     api_key: str
     expires_at: datetime
 
 
 # Wallet Schemas
-class WalletBalanceResponse(BaseModel):
+class WalletBalanceResponse(ResponseModel):
     balance: int = Field(..., description="Wallet balance in kobo")
 
 
@@ -94,12 +105,12 @@ class WalletTransferRequest(BaseModel):
     amount: int = Field(..., gt=0, description="Amount to transfer in kobo")
 
 
-class WalletTransferResponse(BaseModel):
+class WalletTransferResponse(ResponseModel):
     status: str
     message: str
 
 
-class TransactionHistoryItem(BaseModel):
+class TransactionHistoryItem(ResponseModel):
     type: str = Field(..., description="Transaction type: deposit or transfer")
     amount: int = Field(..., description="Amount in kobo")
     status: str = Field(..., description="Transaction status: success, pending, failed")
@@ -0,0 +1,425 @@
+"""
+Paystack integration: transaction initialization, webhook verification and
+batched settlement of successful charges.
+
+The webhook endpoint verifies events and stores them before acknowledging
+them; a single worker started in the application lifespan settles stored
+events in batches.
+"""
+import asyncio
+import hashlib
+import hmac
+import logging
+import secrets
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+import httpx
+import orjson
+from fastapi import HTTPException, Request, status
+from sqlalchemy import String, column, delete, select, update, values, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import balance_cache
+from app.config import settings
+from app.database import async_session_maker
+from app.ids import uuid7
+from app.models import (
+    Transaction, TransactionStatus, User, Wallet,
+    ProcessedWebhookEvent, PendingWebhookEvent
+)
+
+logger = logging.getLogger(__name__)
+
+# Paystack API paths (relative to the shared client's base URL)
+PAYSTACK_INITIALIZE_PATH = "/transaction/initialize"
+
+# Paystack signs webhooks with hex-encoded HMAC-SHA512
+PAYSTACK_SIGNATURE_HEX_LENGTH = 128
+
+# Paystack events are a few KB; anything past this is rejected unread
+MAX_WEBHOOK_BODY_BYTES = 64 * 1024
+
+# Webhook events are settled in batches of up to this many, or whatever
+# arrives within the interval, to amortize commits under bursts
+WEBHOOK_BATCH_SIZE = 100
+WEBHOOK_BATCH_INTERVAL_SECONDS = 0.05
+
+# Charges waiting for the worker; past this the webhook asks Paystack to retry
+WEBHOOK_QUEUE_MAX_SIZE = 10_000
+
+# A failing batch is retried this many times, waiting 0.5s, 1s, ... between
+# attempts, before it is left for the next sweep
+WEBHOOK_SETTLE_ATTEMPTS = 3
+WEBHOOK_SETTLE_RETRY_SECONDS = 0.5
+
+# Stored events that weren't handed to this worker (left by a crash, a
+# failed batch or another process) are swept up at startup and this often
+PENDING_EVENT_SWEEP_INTERVAL_SECONDS = 60
+
+# How often old processed-event ids are pruned
+PROCESSED_EVENT_PRUNE_INTERVAL_SECONDS = 60 * 60
+
+# References queued or being settled by the event worker
+_pending_references: set[str] = set()
+
+# Keyed once; copying it per request skips re-deriving the inner/outer pads
+_WEBHOOK_HMAC_TEMPLATE = hmac.new(
+    settings.paystack_webhook_secret.encode('utf-8'),
+    b"",
+    hashlib.sha512
+)
+
+
+async def initiate_transaction(
+    client: httpx.AsyncClient,
+    db: AsyncSession,
+    user: User,
+    amount: int
+) -> tuple[str, str]:
+    """
+    Initialize a Paystack transaction for the user and record it as pending.
+    Returns (reference, authorization URL).
+    """
+    # Generate unique reference (uniqueness is enforced by the
+    # transactions.reference constraint; a 128-bit random collision is negligible)
+    reference = "txn_" + secrets.token_hex(16)
+    
+    # Hand back any connection the auth lookup checked out so the pool slot
+    # isn't held across the Paystack round-trip (the user is already detached)
+    await db.close()
+    
+    # Call Paystack Initialize Transaction API
+    response = await client.post(
+        PAYSTACK_INITIALIZE_PATH,
+        json={
+            "amount": amount,
+            "email": user.email,  # Email from authenticated user
+            "reference": reference,
+            "currency": "NGN"
+        }
+    )
+    
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=status.HTTP_402_PAYMENT_REQUIRED,
+            detail=f"Payment initiation failed: {response.text}"
+        )
+    
+    paystack_data = response.json()
+    
+    if not paystack_data.get("status"):
+        raise HTTPException(
+            status_code=status.HTTP_402_PAYMENT_REQUIRED,
+            detail="Payment initiation failed by Paystack"
+        )
+    
+    authorization_url = paystack_data["data"]["authorization_url"]
+    
+    # Persist transaction in database
+    db.add(Transaction(
+        reference=reference,
+        user_id=user.id,
+        amount=amount,
+        status=TransactionStatus.PENDING,
+        authorization_url=authorization_url
+    ))
+    await db.commit()
+    
+    return reference, authorization_url
+
+
+async def read_verified_event(request: Request, signature: Optional[str]):
+    """
+    Read the webhook body and return the parsed event, raising HTTPException
+    unless it was signed with the webhook secret.
+    """
+    if not signature:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Missing Paystack signature"
+        )
+    
+    invalid_signature = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Invalid signature"
+    )
+    
+    # Reject malformed signatures before reading and hashing the body
+    if len(signature) != PAYSTACK_SIGNATURE_HEX_LENGTH:
+        raise invalid_signature
+    
+    try:
+        provided_signature = bytes.fromhex(signature)
+    except ValueError:
+        raise invalid_signature
+    
+    payload_too_large = HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail="Webhook payload too large"
+    )
+    
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_WEBHOOK_BODY_BYTES:
+        raise payload_too_large
+    
+    # Stream the body into the pre-keyed HMAC state, enforcing the cap as we go
+    mac = _WEBHOOK_HMAC_TEMPLATE.copy()
+    body = bytearray()
+    async for chunk in request.stream():
+        if len(body) + len(chunk) > MAX_WEBHOOK_BODY_BYTES:
+            raise payload_too_large
+        mac.update(chunk)
+        body += chunk
+    
+    if not hmac.compare_digest(mac.digest(), provided_signature):
+        raise invalid_signature
+    
+    return orjson.loads(body)
+
+
+def charge_event(event) -> Optional[tuple[str, str]]:
+    """Return (event id, transaction reference) for a charge.success event, if any"""
+    # Note: Paystack doesn't send webhooks for declined/failed transactions
+    # Failed transactions remain as "pending" in the database
+    # Use the status endpoint to check if needed
+    if not isinstance(event, dict) or event.get("event") != "charge.success":
+        return None
+    data = event.get("data")
+    reference = data.get("reference") if isinstance(data, dict) else None
+    if not isinstance(reference, str) or not reference:
+        return None
+    # Paystack doesn't send a separate event id; the charge id identifies redeliveries
+    charge_id = data.get("id")
+    return f"charge.success:{charge_id if charge_id is not None else reference}", reference
+
+
+async def store_charge(queue: asyncio.Queue, event_id: str, reference: str) -> None:
+    """
+    Store a successful charge for settlement and hand it to the worker. Once
+    this returns the event survives a crash or redeploy, so the webhook can
+    be acknowledged. Charges whose reference is already queued or being
+    settled are skipped, so Paystack retries that arrive in the meantime
+    don't repeat the work. Raises 503 when the worker is too far behind;
+    if the queue fills up after the event is stored, it is left for the
+    periodic sweep instead.
+    """
+    if reference in _pending_references:
+        return
+    
+    if queue.full():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Webhook queue is full, retry later"
+        )
+    
+    async with async_session_maker() as db:
+        await db.execute(
+            pg_insert(PendingWebhookEvent)
+            .values(event_id=event_id, reference=reference)
+            .on_conflict_do_nothing()
+        )
+        await db.commit()
+    
+    try:
+        queue.put_nowait((event_id, reference))
+    except asyncio.QueueFull:
+        # Filled up while the insert was awaited; the row is committed, so
+        # acknowledge and let the next sweep settle it
+        logger.warning("Webhook queue full, leaving %s for the sweep", event_id)
+        return
+    _pending_references.add(reference)
+
+
+async def settle_paystack_charges(event_ids: Optional[Iterable[str]] = None) -> int:
+    """
+    Settle up to WEBHOOK_BATCH_SIZE stored charges in a single transaction:
+    the given events, or the oldest stored ones. Events are claimed with
+    SKIP LOCKED so no two processes settle the same one; redeliveries of
+    events settled before are dropped, then a single statement marks every
+    pending transaction as paid and credits each affected wallet with its
+    total. Returns the number of events claimed.
+    """
+    claim = (
+        select(PendingWebhookEvent.event_id)
+        .order_by(PendingWebhookEvent.received_at)
+        .limit(WEBHOOK_BATCH_SIZE)
+        .with_for_update(skip_locked=True)
+    )
+    if event_ids is not None:
+        claim = claim.where(PendingWebhookEvent.event_id.in_(list(event_ids)))
+    
+    async with async_session_maker() as db:
+        # Take the events off the stored queue; this only sticks if the batch commits
+        result = await db.execute(
+            delete(PendingWebhookEvent)
+            .where(PendingWebhookEvent.event_id.in_(claim))
+            .returning(PendingWebhookEvent.event_id, PendingWebhookEvent.reference)
+        )
+        claimed = result.all()
+        if not claimed:
+            return 0
+        
+        # Record the events; redeliveries already settled stop here
+        result = await db.execute(
+            pg_insert(ProcessedWebhookEvent)
+            .values([{"event_id": event_id} for event_id, _ in claimed])
+            .on_conflict_do_nothing()
+            .returning(ProcessedWebhookEvent.event_id)
+        )
+        new_event_ids = set(result.scalars())
+        references = list({
+            reference for event_id, reference in claimed
+            if event_id in new_event_ids
+        })
+        if not references:
+            await db.commit()
+            return len(claimed)
+        
+        # One statement: mark the still-pending transactions as paid and credit
+        # each owner's wallet with their total, creating wallets as needed.
+        # Owners aren't known up front, so every reference brings a UUIDv7
+        # candidate id and a new wallet takes one of its owner's.
+        # Rows go in user_id order so concurrent batches lock shared wallets
+        # in the same order
+        settled = (
+            update(Transaction)
+            .where(
+                Transaction.reference.in_(references),
+                Transaction.status == TransactionStatus.PENDING
+            )
+            .values(
+                status=TransactionStatus.SUCCESS,
+                paid_at=datetime.now(timezone.utc)
+            )
+            .returning(Transaction.reference, Transaction.user_id, Transaction.amount)
+            .cte("settled")
+        )
+        wallet_ids = values(
+            column("reference", String),
+            column("wallet_id", String),
+            name="wallet_ids"
+        ).data([(reference, uuid7()) for reference in references])
+        credits = (
+            select(
+                func.min(wallet_ids.c.wallet_id),
+                settled.c.user_id,
+                func.sum(settled.c.amount)
+            )
+            .join_from(settled, wallet_ids, wallet_ids.c.reference == settled.c.reference)
+            .where(settled.c.user_id.is_not(None))
+            .group_by(settled.c.user_id)
+            .order_by(settled.c.user_id)
+        )
+        insert_stmt = pg_insert(Wallet).from_select(["id", "user_id", "balance"], credits)
+        result = await db.execute(
+            insert_stmt.on_conflict_do_update(
+                index_elements=[Wallet.user_id],
+                set_={
+                    "balance": Wallet.balance + insert_stmt.excluded.balance,
+                    "updated_at": func.now()
+                }
+            )
+            .returning(Wallet.user_id)
+        )
+        credited_user_ids = list(result.scalars())
+        
+        await db.commit()
+    
+    await balance_cache.invalidate(*credited_user_ids)
+    return len(claimed)
+
+
+async def settle_with_retries(event_ids: list[str]) -> None:
+    """Settle the given stored charges, retrying with backoff on failure"""
+    for attempt in range(WEBHOOK_SETTLE_ATTEMPTS):
+        try:
+            await settle_paystack_charges(event_ids)
+            return
+        except Exception:
+            if attempt == WEBHOOK_SETTLE_ATTEMPTS - 1:
+                # The charges stay stored and are picked up by the next sweep
+                logger.exception("Failed to settle a batch of %d Paystack charges", len(event_ids))
+                return
+            logger.warning("Failed to settle a batch of Paystack charges, retrying", exc_info=True)
+            await asyncio.sleep(WEBHOOK_SETTLE_RETRY_SECONDS * 2 ** attempt)
+
+
+async def sweep_pending_charges() -> None:
+    """Settle every stored charge, oldest first"""
+    try:
+        while await settle_paystack_charges() == WEBHOOK_BATCH_SIZE:
+            pass
+    except Exception:
+        logger.exception("Failed to settle stored Paystack charges")
+
+
+async def run_paystack_event_worker(queue: asyncio.Queue) -> None:
+    """
+    Drain queued (event id, reference) charges, up to WEBHOOK_BATCH_SIZE at a
+    time or whatever arrives within WEBHOOK_BATCH_INTERVAL_SECONDS, and sweep
+    up other stored charges every PENDING_EVENT_SWEEP_INTERVAL_SECONDS.
+    A None item stops the worker after the current batch.
+    """
+    loop = asyncio.get_running_loop()
+    stopping = False
+    next_sweep = loop.time()
+    
+    while not stopping:
+        if loop.time() >= next_sweep:
+            await sweep_pending_charges()
+            next_sweep = loop.time() + PENDING_EVENT_SWEEP_INTERVAL_SECONDS
+        
+        try:
+            charge = await asyncio.wait_for(queue.get(), next_sweep - loop.time())
+        except asyncio.TimeoutError:
+            continue
+        if charge is None:
+            break
+        
+        event_id, reference = charge
+        batch = {reference: event_id}
+        deadline = loop.time() + WEBHOOK_BATCH_INTERVAL_SECONDS
+        
+        while len(batch) < WEBHOOK_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                charge = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if charge is None:
+                stopping = True
+                break
+            event_id, reference = charge
+            batch[reference] = event_id
+        
+        try:
+            await settle_with_retries(list(batch.values()))
+        finally:
+            _pending_references.difference_update(batch)
+
+
+async def prune_processed_events() -> None:
+    """Delete processed event ids older than the retention window"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=settings.webhook_event_retention_days)
+    async with async_session_maker() as db:
+        await db.execute(
+            delete(ProcessedWebhookEvent).where(ProcessedWebhookEvent.received_at < cutoff)
+        )
+        await db.commit()
+
+
+async def run_processed_event_pruner() -> None:
+    """
+    Periodically prune processed event ids. Redeliveries of older events
+    are still credited once thanks to the PENDING guard on settlement.
+    """
+    while True:
+        try:
+            await prune_processed_events()
+        except Exception:
+            logger.exception("Failed to prune processed Paystack events")
+        await asyncio.sleep(PROCESSED_EVENT_PRUNE_INTERVAL_SECONDS)
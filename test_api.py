@@ -5,208 +5,342 @@ This script tests all endpoints to verify everything works correctly.
 
 import httpx
 import asyncio
+import argparse
+import functools
+import hashlib
+import io
 import json
+import random
+import sys
+import time
+from dataclasses import dataclass
 from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+
+import orjson
+
+try:
+    # Optional: pip install httpx-aiohttp to send requests through aiohttp
+    from httpx_aiohttp import AiohttpTransport
+except ImportError:
+    AiohttpTransport = None
 
 
 BASE_URL = "http://localhost:8000"
 
+# Successful responses of idempotent GETs are kept here between runs
+CACHE_DIR = Path(__file__).resolve().parent / ".test_cache"
+CACHE_TTL_SECONDS = 60
+use_cache = True
+# Set by --wait-for-settlement: status tests wait for a payment to be completed
+wait_for_settlement = False
+
+
+def memo(ttl):
+    """
+    Cache (status_code, body) of a successful GET on disk for ttl seconds,
+    keyed by BASE_URL and path. Bypassed with --no-cache.
+    """
+    def decorator(fetch):
+        @functools.wraps(fetch)
+        async def wrapper(client, path):
+            key = hashlib.sha1(f"{BASE_URL}{path}".encode()).hexdigest()
+            cache_file = CACHE_DIR / f"{key}.json"
+            if use_cache:
+                try:
+                    if time.time() - cache_file.stat().st_mtime < ttl:
+                        return tuple(json.loads(cache_file.read_text()))
+                except (OSError, ValueError):
+                    pass
+            
+            status_code, body = await fetch(client, path)
+            if status_code == 200:
+                CACHE_DIR.mkdir(exist_ok=True)
+                cache_file.write_text(json.dumps([status_code, body]))
+            return status_code, body
+        return wrapper
+    return decorator
+
+
+def _json(response: httpx.Response):
+    """Decode a JSON response body with orjson"""
+    return orjson.loads(response.content)
+
+
+@memo(ttl=CACHE_TTL_SECONDS)
+async def get_memoized(client: httpx.AsyncClient, path: str):
+    """GET an endpoint whose response rarely changes between runs"""
+    response = await client.get(path)
+    try:
+        body = _json(response)
+    except ValueError:
+        body = response.text
+    return response.status_code, body
+
+
+async def get_status(client: httpx.AsyncClient, path: str):
+    """GET an endpoint for its status code only; the body is never downloaded"""
+    async with client.stream("GET", path) as response:
+        return response.status_code, None
+
+
+get_status_memoized = memo(ttl=CACHE_TTL_SECONDS)(get_status)
+
+
+# How long the status tests keep polling
+STATUS_POLL_TIMEOUT_SECONDS = 30.0
+
+TRANSACTION_STATUSES = {"pending", "success", "failed"}
+
+
+def _status_available(response: httpx.Response) -> bool:
+    """A 200 carrying a known transaction status, pending included"""
+    if response.status_code != 200:
+        return False
+    try:
+        data = _json(response)
+    except ValueError:
+        return False
+    return isinstance(data, dict) and data.get("status") in TRANSACTION_STATUSES
+
+
+def _status_settled(response: httpx.Response) -> bool:
+    """Like _status_available, but the transaction must no longer be pending"""
+    return _status_available(response) and _json(response)["status"] != "pending"
+
+
+def _status_predicate():
+    return _status_settled if wait_for_settlement else _status_available
+
+
+async def poll_status(
+    client: httpx.AsyncClient,
+    reference: str,
+    *,
+    refresh: bool = False,
+    settled=_status_available,
+    initial: float = 0.25,
+    factor: float = 1.7,
+    max_interval: float = 4.0,
+    timeout: float = STATUS_POLL_TIMEOUT_SECONDS
+) -> httpx.Response:
+    """
+    Poll a transaction's status until settled(response) is true (by default,
+    a valid status, pending included; pass _status_settled to wait for the
+    payment to complete) or timeout runs out, returning the last response. Client errors are returned at once, since asking again
+    won't change them; server errors are retried. The wait grows from initial by
+    factor up to max_interval, with jitter so clients don't poll in step.
+    Each request completes before the next wait starts, so polls never
+    overlap however slow the server is.
+    """
+    params = {"refresh": "true"} if refresh else None
+    deadline = time.monotonic() + timeout
+    interval = initial
+    while True:
+        response = await client.get(f"/payments/{reference}/status", params=params)
+        remaining = deadline - time.monotonic()
+        if settled(response) or response.is_client_error or remaining <= 0:
+            return response
+        await asyncio.sleep(min(random.uniform(interval / 2, interval), remaining))
+        interval = min(interval * factor, max_interval)
+
 
-async def test_health_check():
+@dataclass(slots=True)
+class TestResult:
+    name: str
+    ok: bool
+    ms: float
+    output: str
+    err: Optional[str] = None
+    value: Any = None
+
+
+def aiotest(name, title, hint=None):
+    """
+    Turn a test coroutine into one that returns a TestResult. The test
+    prints into the `out` buffer it is given, so tests that run
+    concurrently don't interleave their output, and returns a truthy value
+    on success. Exceptions fail the test, followed by hint if given.
+    """
+    def decorator(test):
+        @functools.wraps(test)
+        async def wrapper(*args, **kwargs):
+            out = io.StringIO()
+            print("\n" + "="*60, file=out)
+            print(title, file=out)
+            print("="*60, file=out)
+            
+            start = time.perf_counter()
+            try:
+                value = await test(*args, out=out, **kwargs)
+                err = None
+            except Exception as e:
+                value = None
+                err = repr(e)
+                print(f"❌ Error: {e}", file=out)
+                if hint:
+                    print(hint, file=out)
+            ms = (time.perf_counter() - start) * 1000
+            return TestResult(name, bool(value), ms, out.getvalue(), err, value)
+        return wrapper
+    return decorator
+
+
+@aiotest(
+    "Health Check",
+    "TEST 1: Health Check",
+    hint="Make sure the server is running: uvicorn app.main:app --reload"
+)
+async def test_health_check(client: httpx.AsyncClient, *, out: io.StringIO):
     """Test if server is running"""
-    print("\n" + "="*60)
-    print("TEST 1: Health Check")
-    print("="*60)
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(f"{BASE_URL}/health")
-            print(f"✅ Status: {response.status_code}")
-            print(f"Response: {response.json()}")
-            return True
-        except Exception as e:
-            print(f"❌ Error: {e}")
-            print("Make sure the server is running: uvicorn app.main:app --reload")
-            return False
+    response = await client.get("/health")
+    print(f"✅ Status: {response.status_code}", file=out)
+    print(f"Response: {_json(response)}", file=out)
+    print(f"Protocol: {response.http_version}", file=out)
+    return True
 
 
-async def test_google_auth_url():
+@aiotest("Google Auth URL", "TEST 2: Google OAuth URL Generation")
+async def test_google_auth_url(client: httpx.AsyncClient, *, out: io.StringIO):
     """Test Google OAuth URL generation"""
-    print("\n" + "="*60)
-    print("TEST 2: Google OAuth URL Generation")
-    print("="*60)
+    status_code, data = await get_memoized(client, "/auth/google")
+    print(f"✅ Status: {status_code}", file=out)
+    print(f"Google Auth URL generated: {data.get('google_auth_url', '')[:80]}...", file=out)
     
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(f"{BASE_URL}/auth/google")
-            print(f"✅ Status: {response.status_code}")
-            data = response.json()
-            print(f"Google Auth URL generated: {data.get('google_auth_url', '')[:80]}...")
-            
-            # Verify URL structure
-            url = data.get('google_auth_url', '')
-            if 'accounts.google.com' in url and 'client_id' in url:
-                print("✅ URL structure is valid")
-                return True
-            else:
-                print("❌ URL structure invalid")
-                return False
-        except Exception as e:
-            print(f"❌ Error: {e}")
-            return False
-
-
-async def test_payment_initiation():
-    """Test Paystack payment initiation"""
-    print("\n" + "="*60)
-    print("TEST 3: Paystack Payment Initiation")
-    print("="*60)
+    # Verify URL structure
+    url = data.get('google_auth_url', '')
+    if 'accounts.google.com' in url and 'client_id' in url:
+        print("✅ URL structure is valid", file=out)
+        return True
+    else:
+        print("❌ URL structure invalid", file=out)
+        return False
+
+
+@aiotest("Payment Initiation", "TEST 3: Paystack Payment Initiation")
+async def test_payment_initiation(client: httpx.AsyncClient, *, out: io.StringIO):
+    """Test Paystack payment initiation, returning the new reference"""
+    payload = {"amount": 5000}
+    response = await client.post(
+        "/payments/paystack/initiate",
+        json=payload
+    )
+    print(f"Status: {response.status_code}", file=out)
     
-    async with httpx.AsyncClient() as client:
-        try:
-            payload = {"amount": 5000}
-            response = await client.post(
-                f"{BASE_URL}/payments/paystack/initiate",
-                json=payload
-            )
-            print(f"Status: {response.status_code}")
-            
-            if response.status_code == 201:
-                data = response.json()
-                print(f"✅ Payment initiated successfully!")
-                print(f"   Reference: {data.get('reference')}")
-                print(f"   Authorization URL: {data.get('authorization_url', '')[:60]}...")
-                return data.get('reference')
-            else:
-                print(f"❌ Failed: {response.text}")
-                return None
-        except Exception as e:
-            print(f"❌ Error: {e}")
-            return None
-
-
-async def test_transaction_status(reference):
+    if response.status_code == 201:
+        data = _json(response)
+        print(f"✅ Payment initiated successfully!", file=out)
+        print(f"   Reference: {data.get('reference')}", file=out)
+        print(f"   Authorization URL: {data.get('authorization_url', '')[:60]}...", file=out)
+        return data.get('reference')
+    else:
+        print(f"❌ Failed: {response.text}", file=out)
+        return None
+
+
+@aiotest("Transaction Status", "TEST 4: Transaction Status Check")
+async def test_transaction_status(client: httpx.AsyncClient, reference, *, out: io.StringIO):
     """Test transaction status check"""
-    print("\n" + "="*60)
-    print("TEST 4: Transaction Status Check")
-    print("="*60)
-    
     if not reference:
-        print("⚠️  Skipped: No reference from previous test")
+        print("⚠️  Skipped: No reference from previous test", file=out)
         return False
     
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(
-                f"{BASE_URL}/payments/{reference}/status"
-            )
-            print(f"✅ Status: {response.status_code}")
-            data = response.json()
-            print(f"   Reference: {data.get('reference')}")
-            print(f"   Status: {data.get('status')}")
-            print(f"   Amount: {data.get('amount')} kobo")
-            print(f"   Paid At: {data.get('paid_at', 'Not paid yet')}")
-            return True
-        except Exception as e:
-            print(f"❌ Error: {e}")
-            return False
-
-
-async def test_transaction_status_with_refresh(reference):
-    """Test transaction status check with refresh from Paystack"""
-    print("\n" + "="*60)
-    print("TEST 5: Transaction Status Check (with refresh)")
-    print("="*60)
+    response = await poll_status(client, reference, settled=_status_predicate())
+    if response.status_code != 200:
+        print(f"❌ Status: {response.status_code}", file=out)
+        print(f"   Error: {response.text}", file=out)
+        return False
+    
+    print(f"✅ Status: {response.status_code}", file=out)
+    data = _json(response)
+    print(f"   Reference: {data.get('reference')}", file=out)
+    print(f"   Status: {data.get('status')}", file=out)
+    print(f"   Amount: {data.get('amount')} kobo", file=out)
+    print(f"   Paid At: {data.get('paid_at', 'Not paid yet')}", file=out)
     
+    if data.get('status') not in TRANSACTION_STATUSES:
+        print("❌ Response has no valid status", file=out)
+        return False
+    if wait_for_settlement and data['status'] == 'pending':
+        print(f"❌ Still pending after {STATUS_POLL_TIMEOUT_SECONDS:.0f}s", file=out)
+        return False
+    return True
+
+
+@aiotest("Status with Refresh", "TEST 5: Transaction Status Check (with refresh)")
+async def test_transaction_status_with_refresh(client: httpx.AsyncClient, reference, *, out: io.StringIO):
+    """Test transaction status check with refresh from Paystack"""
     if not reference:
-        print("⚠️  Skipped: No reference from previous test")
+        print("⚠️  Skipped: No reference from previous test", file=out)
         return False
     
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(
-                f"{BASE_URL}/payments/{reference}/status?refresh=true"
-            )
-            print(f"✅ Status: {response.status_code}")
-            data = response.json()
-            print(f"   Reference: {data.get('reference')}")
-            print(f"   Status: {data.get('status')}")
-            print(f"   Amount: {data.get('amount')} kobo")
-            return True
-        except Exception as e:
-            print(f"❌ Error: {e}")
-            return False
-
-
-async def test_invalid_payment():
+    response = await poll_status(client, reference, refresh=True, settled=_status_predicate())
+    if response.status_code != 200:
+        print(f"❌ Status: {response.status_code}", file=out)
+        print(f"   Error: {response.text}", file=out)
+        return False
+    
+    print(f"✅ Status: {response.status_code}", file=out)
+    data = _json(response)
+    print(f"   Reference: {data.get('reference')}", file=out)
+    print(f"   Status: {data.get('status')}", file=out)
+    print(f"   Amount: {data.get('amount')} kobo", file=out)
+    
+    if data.get('status') not in TRANSACTION_STATUSES:
+        print("❌ Response has no valid status", file=out)
+        return False
+    if wait_for_settlement and data['status'] == 'pending':
+        print(f"❌ Still pending after {STATUS_POLL_TIMEOUT_SECONDS:.0f}s", file=out)
+        return False
+    return True
+
+
+@aiotest("Invalid Payment", "TEST 6: Invalid Payment (Error Handling)")
+async def test_invalid_payment(client: httpx.AsyncClient, *, out: io.StringIO):
     """Test payment with invalid amount"""
-    print("\n" + "="*60)
-    print("TEST 6: Invalid Payment (Error Handling)")
-    print("="*60)
+    payload = {"amount": -1000}  # Negative amount
+    response = await client.post(
+        "/payments/paystack/initiate",
+        json=payload
+    )
+    print(f"Status: {response.status_code}", file=out)
     
-    async with httpx.AsyncClient() as client:
-        try:
-            payload = {"amount": -1000}  # Negative amount
-            response = await client.post(
-                f"{BASE_URL}/payments/paystack/initiate",
-                json=payload
-            )
-            print(f"Status: {response.status_code}")
-            
-            if response.status_code == 400 or response.status_code == 422:
-                print(f"✅ Correctly rejected invalid amount")
-                print(f"   Error: {response.json()}")
-                return True
-            else:
-                print(f"❌ Should have rejected negative amount")
-                return False
-        except Exception as e:
-            print(f"❌ Error: {e}")
-            return False
-
-
-async def test_nonexistent_transaction():
+    if response.status_code == 400 or response.status_code == 422:
+        print(f"✅ Correctly rejected invalid amount", file=out)
+        print(f"   Error: {_json(response)}", file=out)
+        return True
+    else:
+        print(f"❌ Should have rejected negative amount", file=out)
+        return False
+
+
+@aiotest("Non-existent Transaction", "TEST 7: Non-existent Transaction (Error Handling)")
+async def test_nonexistent_transaction(client: httpx.AsyncClient, *, out: io.StringIO):
     """Test fetching non-existent transaction"""
-    print("\n" + "="*60)
-    print("TEST 7: Non-existent Transaction (Error Handling)")
-    print("="*60)
+    status_code, _ = await get_status(
+        client, "/payments/fake_reference_12345/status"
+    )
+    print(f"Status: {status_code}", file=out)
     
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(
-                f"{BASE_URL}/payments/fake_reference_12345/status"
-            )
-            print(f"Status: {response.status_code}")
-            
-            if response.status_code == 404:
-                print(f"✅ Correctly returned 404 for non-existent transaction")
-                return True
-            else:
-                print(f"❌ Should have returned 404")
-                return False
-        except Exception as e:
-            print(f"❌ Error: {e}")
-            return False
-
-
-async def test_api_docs():
+    if status_code == 404:
+        print(f"✅ Correctly returned 404 for non-existent transaction", file=out)
+        return True
+    else:
+        print(f"❌ Should have returned 404", file=out)
+        return False
+
+
+@aiotest("API Documentation", "TEST 8: API Documentation Accessibility")
+async def test_api_docs(client: httpx.AsyncClient, *, out: io.StringIO):
     """Test if API documentation is accessible"""
-    print("\n" + "="*60)
-    print("TEST 8: API Documentation Accessibility")
-    print("="*60)
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(f"{BASE_URL}/docs")
-            if response.status_code == 200:
-                print(f"✅ API docs accessible at {BASE_URL}/docs")
-                return True
-            else:
-                print(f"❌ API docs not accessible")
-                return False
-        except Exception as e:
-            print(f"❌ Error: {e}")
-            return False
+    status_code, _ = await get_status_memoized(client, "/docs")
+    if status_code == 200:
+        print(f"✅ API docs accessible at {BASE_URL}/docs", file=out)
+        return True
+    else:
+        print(f"❌ API docs not accessible", file=out)
+        return False
 
 
 async def run_all_tests():
@@ -217,50 +351,69 @@ async def run_all_tests():
     print(f"\nTesting API at: {BASE_URL}")
     print(f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
     
-    results = []
-    
-    # Test 1: Health Check (must pass to continue)
-    health_ok = await test_health_check()
-    results.append(("Health Check", health_ok))
-    
-    if not health_ok:
-        print("\n❌ Server is not running. Please start it with:")
-        print("   uvicorn app.main:app --reload")
-        return
-    
-    # Test 2: Google Auth URL
-    results.append(("Google Auth URL", await test_google_auth_url()))
-    
-    # Test 3: Payment Initiation
-    reference = await test_payment_initiation()
-    results.append(("Payment Initiation", reference is not None))
-    
-    # Test 4: Transaction Status
-    results.append(("Transaction Status", await test_transaction_status(reference)))
-    
-    # Test 5: Transaction Status with Refresh
-    results.append(("Status with Refresh", await test_transaction_status_with_refresh(reference)))
-    
-    # Test 6: Invalid Payment
-    results.append(("Invalid Payment", await test_invalid_payment()))
-    
-    # Test 7: Non-existent Transaction
-    results.append(("Non-existent Transaction", await test_nonexistent_transaction()))
+    # One client for the whole run so connections are reused between tests.
+    # The pool is sized so every connection opened for a batch is kept alive
+    limits = httpx.Limits(max_connections=10, max_keepalive_connections=10, keepalive_expiry=30.0)
+    if AiohttpTransport:
+        # aiohttp only speaks HTTP/1.1; the transport applies the pool limits
+        connection_options = {"transport": AiohttpTransport(limits=limits)}
+    else:
+        # Over https the concurrent requests share one HTTP/2 connection
+        connection_options = {"limits": limits, "http2": True}
+    async with httpx.AsyncClient(
+        base_url=BASE_URL,
+        timeout=10.0,
+        **connection_options
+    ) as client:
+        # Warm up: open a connection (DNS, TCP, TLS) before the tests start.
+        # Failures are left for the health check to report
+        try:
+            await client.get("/health")
+        except httpx.HTTPError:
+            pass
+        
+        # Test 1 (Health Check) runs alongside tests 2, 6, 7 and 8, which don't
+        # depend on anything; the rest only run if the server is up
+        health, auth, invalid, nonexistent, docs = await asyncio.gather(
+            test_health_check(client),
+            test_google_auth_url(client),
+            test_invalid_payment(client),
+            test_nonexistent_transaction(client),
+            test_api_docs(client)
+        )
+        
+        if not health.ok:
+            for result in (health, auth, invalid, nonexistent, docs):
+                sys.stdout.write(result.output)
+            print("\n❌ Server is not running. Please start it with:")
+            print("   uvicorn app.main:app --reload")
+            return
+        
+        # Test 3: Payment Initiation
+        payment = await test_payment_initiation(client)
+        reference = payment.value
+        
+        # Tests 4 and 5 only need the reference from test 3
+        status, refresh = await asyncio.gather(
+            test_transaction_status(client, reference),
+            test_transaction_status_with_refresh(client, reference)
+        )
     
-    # Test 8: API Docs
-    results.append(("API Documentation", await test_api_docs()))
+    # Write each test's output in order, now that none are running
+    results = [health, auth, payment, status, refresh, invalid, nonexistent, docs]
+    sys.stdout.write("".join(result.output for result in results))
     
     # Summary
     print("\n" + "="*60)
     print("TEST SUMMARY")
     print("="*60)
     
-    passed = sum(1 for _, result in results if result)
+    passed = sum(1 for result in results if result.ok)
     total = len(results)
     
-    for test_name, result in results:
-        status = "✅ PASS" if result else "❌ FAIL"
-        print(f"{status} - {test_name}")
+    for result in results:
+        status = "✅ PASS" if result.ok else "❌ FAIL"
+        print(f"{status} - {result.name} ({result.ms:.1f} ms)")
     
     print(f"\n{'='*60}")
     print(f"Results: {passed}/{total} tests passed ({(passed/total)*100:.1f}%)")
@@ -284,4 +437,18 @@ async def run_all_tests():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Test the API against a running server")
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Fetch every endpoint instead of reusing cached responses"
+    )
+    parser.add_argument(
+        "--wait-for-settlement",
+        action="store_true",
+        help="Make the status tests wait for the payment to be completed"
+    )
+    args = parser.parse_args()
+    use_cache = not args.no_cache
+    wait_for_settlement = args.wait_for_settlement
     asyncio.run(run_all_tests())